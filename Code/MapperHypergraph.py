@@ -54,9 +54,12 @@ simplicial complex.
 """
 
 
-import copy
+import functools
 import hypernetx as hnx
 import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 class Node:
     """
@@ -67,137 +70,338 @@ class Node:
     parent (str): the node's parent in the tree
     name (str): the node's label
     children (list): a list of the node's children
-    child_names (list):  a list of the labels of the node's children
-    contents (set): a set containing all data points assigned to the node's corresponding simplex
-    lineage (list): a list of the Mapper nodes forming the vertices of this node's corresponding simplex
+    children_by_name (dict): a dictionary from the labels of the node's children to the children
+    bits (int): a bitset of the integer ids of the data points assigned to the node's corresponding simplex, with bit i
+        set if the data point with id i is assigned
+    contents (set): a set containing all data points assigned to the node's corresponding simplex (translated from bits
+        on first use, then kept)
+    points (list): the data point corresponding to each id, shared by all nodes in the tree
+    lineage (tuple): a tuple of the Mapper nodes forming the vertices of this node's corresponding simplex
     leaf (binary): indicates if the node is a leaf
+    maximal (binary): indicates if the node's corresponding simplex is maximal (not a face of any other simplex)
     """
-    def __init__(self, parent, name, contents, lineage):
+    def __init__(self, parent, name, contents=None, lineage=(), bits=None, points=None):
         """
         Parameters
         ----------
         parent (str): the node's parent in the tree
         name (str): the node's label
         children (list): a list of the node's children
-        child_names (list):  a list of the labels of the node's children
-        contents (set): a set containing all data points assigned to the node's corresponding simplex
-        lineage (list): a list of the Mapper nodes forming the vertices of this node's corresponding simplex
+        children_by_name (dict): a dictionary from the labels of the node's children to the children
+        contents (set): a set containing all data points assigned to the node's corresponding simplex (if not given, it
+            is translated from bits and points)
+        lineage (tuple): a tuple of the Mapper nodes forming the vertices of this node's corresponding simplex
+        bits (int): a bitset of the integer ids of the data points assigned to the node's corresponding simplex
+        points (list): the data point corresponding to each id
         leaf (binary): indicates if the node is a leaf
+        maximal (binary): indicates if the node's corresponding simplex is maximal (not a face of any other simplex)
         """
         self.parent=parent
         self.name=name
         self.children=[]
-        self.child_names=[]
-        self.contents=contents
+        self.children_by_name={}
+        self.bits=bits
+        self.points=points
         self.lineage=lineage
         self.leaf=0
-    def Add_Child(self, name, contents):
+        self.maximal=0
+        #Contents given directly take the place of the translation from bits
+        if contents is not None:
+            self.contents=contents
+    @functools.cached_property
+    def contents(self):
+        """The set of data points assigned to the node's corresponding simplex, translated from bits once and kept."""
+        if self.bits is None:
+            return None
+        points=self.points
+        return {points[i] for i in _Ids_From_Bits(self.bits)}
+    def Add_Child(self, name, contents=None, bits=None):
         """
         Creates a new node a a child of the existing node.
         
         Parameters
         ----------
         name (str): the name of the child node
-        contents (set): the data points assigned to the child node's corresponding simplex
+        contents (set): the data points assigned to the child node's corresponding simplex (if not given, they are
+            translated from bits)
+        bits (int): the bitset of ids of the data points assigned to the child node's corresponding simplex
         """
-        lineage=[item for item in self.lineage]
-        lineage.append(name)
-        child=Node(parent=self, name=name, contents=contents, lineage=lineage)
+        child=Node(parent=self, name=name, contents=contents, lineage=self.lineage+(name,), bits=bits,
+                   points=self.points)
         self.children.append(child)
-        self.child_names.append(name)
+        self.children_by_name[name]=child
+
+def _Bits_From_Ids(ids):
+    """Take list of integer ids, return bitset (as an int) with the bit of each id set."""
+    if not ids:
+        return 0
+    buffer=bytearray(max(ids)//8+1)
+    for i in ids:
+        buffer[i>>3]|=1<<(i&7)
+    return int.from_bytes(buffer,'little')
+
+#The number of data points in a bitset is counted with int.bit_count where available (Python 3.10+), which counts the
+#set bits in place rather than building a binary string
+if hasattr(int,'bit_count'):
+    _Popcount=int.bit_count
+else:
+    def _Popcount(bits):
+        """Take bitset (as an int), return number of set bits."""
+        return bin(bits).count('1')
+
+def _Ids_From_Bits(bits):
+    """Take bitset (as an int), return list of the ids of its set bits in increasing order."""
+    #The binary string is reversed so that string positions match bit positions
+    digits=bin(bits)[:1:-1]
+    ids=[]
+    i=digits.find('1')
+    while i>=0:
+        ids.append(i)
+        i=digits.find('1',i+1)
+    return ids
+
+def _Sweep_Children(Bits):
+    """Take list of bitsets of sibling nodes, return list of (i,j,bits) for each pair of siblings i<j with non-empty intersection bits."""
+    #Works on plain lists of ints rather than Node objects, so the loop does no attribute lookups or node creation
+    Pairs=[]
+    count=len(Bits)
+    if count<2:
+        return Pairs
+    #For large sibling lists, first try to find the overlapping pairs from an index of the siblings containing each
+    #data point, which touches only pairs sharing a point. This is only used when the index is smaller than the
+    #full pairwise sweep
+    if count>=16:
+        Candidates=_Overlapping_Pairs(Bits)
+        if Candidates is not None:
+            for i,j in Candidates:
+                Pairs.append((i,j,Bits[i]&Bits[j]))
+            return Pairs
+    #Otherwise each sibling is compared with every higher-indexed sibling
+    append=Pairs.append
+    for i in range(count):
+        bits_i=Bits[i]
+        #A sibling with no data points can't intersect any other sibling, so its sweep is skipped
+        if bits_i:
+            for j in range(i+1,count):
+                child_bits=bits_i&Bits[j]
+                if child_bits:
+                    append((i,j,child_bits))
+    return Pairs
+
+def _Overlapping_Pairs(Bits):
+    """Take list of bitsets of sibling nodes, return sorted list of pairs (i,j) with i<j of siblings sharing a data point, or None if finding them would cost more than checking every pair."""
+    pairs=len(Bits)*(len(Bits)-1)//2
+    if sum(map(_Popcount,Bits))>=pairs:
+        return None
+    Members={}
+    #Members records the indices of the siblings containing each data point, in increasing order
+    for i,bits in enumerate(Bits):
+        for point in _Ids_From_Bits(bits):
+            Members.setdefault(point,[]).append(i)
+    if sum(len(members)*(len(members)-1)//2 for members in Members.values())>=pairs:
+        return None
+    Candidates=set()
+    for members in Members.values():
+        if len(members)>1:
+            Candidates.update(itertools.combinations(members,2))
+    return sorted(Candidates)
+
+def _Sweep_Cofaces(Names,Bits,Upper):
+    """Take lists of names and bitsets of sibling nodes and dictionary Upper from each Mapper node to its higher-indexed neighbours in the Mapper graph, return list of (i,j,bits) for each pair of siblings i<j with non-empty intersection bits."""
+    #Two siblings can only intersect if the Mapper nodes they are named after share an edge, so each sibling is only
+    #compared with the later siblings among its upper neighbours (the candidate restriction of the Add-Cofaces
+    #algorithm). Siblings are ordered by Mapper node, so every upper neighbour among them is a later sibling
+    Positions={name:k for k,name in enumerate(Names)}
+    Pairs=[]
+    append=Pairs.append
+    count=len(Names)
+    for i in range(count):
+        upper=Upper[Names[i]]
+        #The candidates are found from whichever of the upper neighbours and the later siblings is shorter
+        if len(upper)<count-i-1:
+            Candidates=sorted(Positions[name] for name in upper if name in Positions)
+        else:
+            Candidates=[j for j in range(i+1,count) if Names[j] in upper]
+        bits_i=Bits[i]
+        for j in Candidates:
+            child_bits=bits_i&Bits[j]
+            if child_bits:
+                append((i,j,child_bits))
+    return Pairs
+
+def _Search_Children(Parent_Node,Leaves,max_dim=None,Upper=None):
+    """Take node of simplex tree, list of leaves, optional maximum simplex dimension max_dim and optional dictionary Upper from each Mapper node to its higher-indexed neighbours, add the simplices formed by intersecting Parent_Node's children as their children, record new leaves in Leaves, return list of Parent_Node's children which need to be searched in turn."""
+    Search_List=Parent_Node.children
+    #The children of Parent_Node's children are (len(Parent_Node.lineage)+1)-simplices, and their children would be
+    #one dimension higher. Neither are formed if that would exceed max_dim
+    dim=len(Parent_Node.lineage)+1
+    grow=max_dim is None or dim+1<=max_dim
+    if max_dim is None or dim<=max_dim:
+        #Compares each child of Parent_Node with all higher-indexed siblings, adding non-empty intersections as
+        #children of the lower-indexed child. Each child's pairs come back in sibling order, so its children stay in
+        #order. Once the edges are known (Upper), only pairs of siblings named after neighbouring Mapper nodes are
+        #compared
+        Bits=[child.bits for child in Search_List]
+        if Upper is None:
+            Pairs=_Sweep_Children(Bits)
+        else:
+            Pairs=_Sweep_Cofaces([child.name for child in Search_List],Bits,Upper)
+        for i,j,child_bits in Pairs:
+            Search_List[i].Add_Child(Search_List[j].name,bits=child_bits)
+    To_Search=[]
+    for Search_Node in Search_List:
+        #This loop classifies the searched children by their number of children
+        children=Search_Node.children
+        count=len(children)
+        #If the node has multiple children, it may have further simplices as descendents, and so is searched next
+        if count>1 and grow:
+            To_Search.append(Search_Node)
+        #If the node has only one child (or its children can't have children of their own under max_dim), its children
+        #are leaves
+        elif count>=1:
+            for child in children:
+                child.leaf=1
+                Leaves.append(child)
+        #Otherwise, the node has no children and is thus a leaf itself
+        else:
+            Search_Node.leaf=1
+            Leaves.append(Search_Node)
+    return To_Search
+
+def _Add_Cofaces(Parent_Node,Upper,Leaves,max_dim=None):
+    """Take node of simplex tree, dictionary Upper from each Mapper node to its higher-indexed neighbours, list of leaves and optional maximum simplex dimension max_dim, add all simplices below Parent_Node depth first, recording the leaves in Leaves."""
+    for Search_Node in _Search_Children(Parent_Node,Leaves,max_dim,Upper):
+        _Add_Cofaces(Search_Node,Upper,Leaves,max_dim)
+
+def _Grow_Subtree(Start_Node,Upper,max_dim=None):
+    """Take node of simplex tree, dictionary Upper from each Mapper node to its higher-indexed neighbours and optional maximum simplex dimension max_dim, add all simplices below it, return Start_Node and list of leaves below it."""
+    Leaves=[]
+    _Add_Cofaces(Start_Node,Upper,Leaves,max_dim)
+    #Start_Node is returned so that worker processes send back the grown copy
+    return Start_Node,Leaves
+
+def _Share_Points(Start_Node,points):
+    """Take node of simplex tree and list of data points (or None), set points as the points list of Start_Node and all of its descendents."""
+    List=[Start_Node]
+    while List:
+        node=List.pop()
+        node.points=points
+        List.extend(node.children)
         
 #Given a dictionary with Mapper node names as keys and sets of data points as values, Build_simplex_Tree builds a
 #simplex tree of the simplicial complex generated by the Mapper. It returns the Root node, which contains pointers to
 #all of its children.
-def Build_Simplex_Tree(Mapper_Node_Dict):
-    """Take dictionary of Mapper nodes to included data points, return simplex tree of Mapper hypergraph."""
+def Build_Simplex_Tree(Mapper_Node_Dict,n_jobs=None,max_dim=None):
+    """Take dictionary of Mapper nodes to included data points, optional number of worker processes n_jobs (None for no workers, -1 for one per CPU, -2 for all CPUs but one and so on) and optional maximum simplex dimension max_dim (None for the full complex, 1 for the Mapper graph), return simplex tree of Mapper hypergraph."""
+    #n_jobs is checked (and negative values resolved against the CPU count) before any work is done, so an invalid
+    #value can't leave the tree half-built with 0-simplices detached from the root
+    if n_jobs is not None:
+        if n_jobs<0:
+            n_jobs=max((os.cpu_count() or 1)+1+n_jobs,1)
+        elif n_jobs==0:
+            raise ValueError("n_jobs must be None, a positive number of worker processes or a negative number "
+                             "(-1 for one per CPU), not 0")
     Leaves=[]
-    Root=Node(parent=None,name='root',contents=None,lineage=[])
+    Points=[]
+    Root=Node(parent=None,name='root',lineage=(),points=Points)
+    #Data points are replaced by integer ids (numbered in order of first appearance) and each node's data points are
+    #stored as a bitset of those ids, so intersections are a single bitwise and. The root keeps the list of data
+    #points (shared with every node) so that node contents can be translated back
+    Point_Ids={}
     for node in Mapper_Node_Dict.keys():
-        Root.Add_Child(name=node,contents=Mapper_Node_Dict[node])
-    List=[Root]
-    #List is a list of nodes whose children still need to be searched for non-empty intersections
-    while List:
-        #While List is nonempty
-        Parent_Node=List[0]
-        Search_List=Parent_Node.children
-        index=0
-        while index<len(Search_List):
-            #This loop searches through the list of children of the first node in Lisst
-            Search_Node=Search_List[index]
-            for Sibling in Search_List[index+1::]:
-                #Compares one child with all highre-indexed siblings, adding non-empty intersections as children of the
-                #lower-indexed child
-                child_contents=Search_Node.contents.intersection(Sibling.contents)
-                if child_contents:
-                    Search_Node.Add_Child(name=Sibling.name,contents=child_contents)
-            #If the node has multiple children, it may have further simplices as descendents, and so is added to List
-            if len(Search_Node.children)>1:
-                List.append(Search_Node)
-            #If the node has only one child, that child is a leaf
-            elif len(Search_Node.children)==1:
-                Search_Node.children[0].leaf=1
-                Leaves.append(Search_Node.children[0])
-            #Otherwise, the node has no children and is thus a leaf itself
-            else:
-                Search_Node.leaf=1
-                Leaves.append(Search_Node)
-            index+=1
-        del List[0]
+        ids=[Point_Ids.setdefault(point,len(Point_Ids)) for point in Mapper_Node_Dict[node]]
+        Root.Add_Child(name=node,bits=_Bits_From_Ids(ids))
+    Points.extend(Point_Ids)
+    #Once the edges are found, the subtree below each 0-simplex depends only on that 0-simplex's children, so the
+    #subtrees can be grown independently. With n_jobs, they are grown in worker processes. Each 0-simplex is sent
+    #detached from the root (so the rest of the tree isn't copied with it) and the grown copy replaces it in the tree
+    Subtrees=_Search_Children(Root,Leaves,max_dim)
+    #Upper maps each Mapper node to its higher-indexed neighbours in the Mapper graph, which are the names of its
+    #children in the tree
+    Upper={vertex.name:vertex.children_by_name for vertex in Root.children}
+    if n_jobs is None or n_jobs==1 or len(Subtrees)<2:
+        for vertex in Subtrees:
+            Leaves.extend(_Grow_Subtree(vertex,Upper,max_dim)[1])
+    else:
+        #Each worker is only sent the edges among the neighbours of its 0-simplex, as plain sets of names
+        Links=[]
+        for vertex in Subtrees:
+            neighbours=vertex.children_by_name.keys()
+            Links.append({name:Upper[name].keys()&neighbours for name in neighbours})
+        Positions={vertex.name:k for k,vertex in enumerate(Root.children)}
+        #The shared points list is also removed from each subtree before it is sent, and restored once it is back
+        try:
+            for vertex in Subtrees:
+                vertex.parent=None
+                _Share_Points(vertex,None)
+            with ProcessPoolExecutor(max_workers=n_jobs) as Pool:
+                for vertex,leaves in Pool.map(_Grow_Subtree,Subtrees,Links,itertools.repeat(max_dim)):
+                    vertex.parent=Root
+                    _Share_Points(vertex,Points)
+                    Root.children[Positions[vertex.name]]=vertex
+                    Root.children_by_name[vertex.name]=vertex
+                    Leaves.extend(leaves)
+        finally:
+            #If a worker failed, the vertices not yet replaced by their grown copies are reattached to the tree
+            for vertex in Subtrees:
+                if Root.children[Positions[vertex.name]] is vertex:
+                    vertex.parent=Root
+                    _Share_Points(vertex,Points)
+    #Every simplex is a face of the simplex of some leaf below it, so a leaf is maximal exactly when no other leaf's
+    #lineage properly contains its own. Any such leaf contains the last node in the lineage, so we index the leaves by
+    #the Mapper nodes in their lineages and only compare each leaf against the leaves sharing its last node. The
+    #lineage sets are built once, and each index entry lists them from longest to shortest, so a leaf's comparisons
+    #stop at the first lineage no longer than its own
+    Lineage_Sets=[frozenset(leaf.lineage) for leaf in Leaves]
+    Label_To_Lineages={}
+    for lineage in sorted(Lineage_Sets,key=len,reverse=True):
+        for label in lineage:
+            Label_To_Lineages.setdefault(label,[]).append(lineage)
+    for leaf,lineage in zip(Leaves,Lineage_Sets):
+        size=len(lineage)
+        leaf.maximal=1
+        for match in Label_To_Lineages[leaf.lineage[-1]]:
+            if len(match)<=size:
+                break
+            if lineage<=match:
+                leaf.maximal=0
+                break
     #Returns the Root node (which links to its descendents) and the list of leaf nodes
     return Root, Leaves
 
-def Find_Max_Leaves(Leaves):
-    """Take list of leaves in simplex tree, return list of leaves representing maximal simplices."""
-    Max_Leaves=[]
-    for i in range(len(Leaves)):
-        #Iterates through all pairs of leaves in the simplex tree, recording leaves which don't represent proper
-        #sub-faces of any other simplex
-        leaf=Leaves[i]
-        found=0
-        for j in range(len(Leaves)):
-            if i!=j:
-                match=Leaves[j]
-                if set(leaf.lineage).issubset(set(match.lineage)):
-                    found=1
-        if found==0:
-            Max_Leaves.append(leaf)
-                
-    return Max_Leaves
-        
 
 def Build_Hypergraph(Root_Node, Max_Leaves=None):
     """Take root of simplex tree as Root_Node, optionally list of maximal simplices as Max_Leaves, return hypergraph with all edges (if Max_Leaves is None) or edges repressenting maximal leaves (otherwise)."""
-    i=1
-    #i is an index variable
     hypergraph={}
-    #hypergraph records edges to turn into a hypergraph object
-    if Max_Leaves==None:
-        #If Max_Leaves==None, the function includes all edges in the hypergraph
-        List=[Root_Node]
+    #hypergraph records edges to turn into a hypergraph object, keyed by 1, 2, 3, ... in the order they are recorded
+    if Max_Leaves is None:
+        #If Max_Leaves is None, the function includes all edges in the hypergraph. The root and the 0-simplices aren't
+        #recorded as edges, so the search starts from the 1-simplices (the grandchildren of the root)
+        List=deque()
+        for vertex in Root_Node.children:
+            List.extend(vertex.children)
+        popleft=List.popleft
+        extend=List.extend
         while List:
-            #Iterates through all nodes in simplex tree, recording represented simplices as hypergraph edges
-            if len(List[0].lineage)>1:
-                hypergraph[i]=List[0].lineage
-                i+=1
-            List.extend(List[0].children)
-            List=List[1::]
+            #Iterates through all remaining nodes in simplex tree, recording represented simplices as hypergraph edges
+            node=popleft()
+            hypergraph[len(hypergraph)+1]=list(node.lineage)
+            extend(node.children)
     else:
         #If Max_Leaves is a list of maximal leaves, records only the maximal simplices as edges. All other edges follow
-        #from simplicial complex including sub-faces
-        List=Max_Leaves
-        for leaf in Max:
-            hypergraph[i]=leaf.lineage
-            i+=1
+        #from simplicial complex including sub-faces. Mapper nodes that don't intersect any other node are their own
+        #maximal leaves, so they are recorded as single-node edges
+        for leaf in Max_Leaves:
+            hypergraph[len(hypergraph)+1]=list(leaf.lineage)
             
     #Returns the recorded edge list as a hypergraph object
     return hnx.Hypergraph(hypergraph)
 
-def Build_Hypergraph_From_Dict(Mapper_Node_Dict,draw=False):
-    """Take dictionary of Mapper nodes to included data points and optional True/False toggle draw, return root node of simplex tree as Root, hypergraph depiction of simplex tree as Hypergraph, and draw Hypergraph if draw is True."""
+def Build_Hypergraph_From_Dict(Mapper_Node_Dict,draw=False,n_jobs=None,max_dim=None):
+    """Take dictionary of Mapper nodes to included data points, optional True/False toggle draw, optional number of worker processes n_jobs and optional maximum simplex dimension max_dim (both passed to Build_Simplex_Tree), return root node of simplex tree as Root, hypergraph depiction of simplex tree as Hypergraph, and draw Hypergraph if draw is True."""
     #Wrapper for Hypergraph functions
-    Root,Leaves=Build_Simplex_Tree(Mapper_Node_Dict)
-    Max_Leaves=Find_Min_Leaves(Leaves)
+    Root,Leaves=Build_Simplex_Tree(Mapper_Node_Dict,n_jobs=n_jobs,max_dim=max_dim)
+    Max_Leaves=[leaf for leaf in Leaves if leaf.maximal]
     Hypergraph=Build_Hypergraph(Root,Max_Leaves=Max_Leaves)
     if draw:
         hnx.drawing.draw(Hypergraph)